@@ -56,7 +56,8 @@ def start_game_gui(grid: Grid, max_steps: int = 200, step_time: int = 300,
     green = (0, 100, 0)
     yellow = (200, 200, 0)
     gray = (50, 50, 50)
-    cell_colors = [white, red, yellow, green]
+    # The last color is used for empty cells that are part of the trajectory of a pedestrian
+    cell_colors = [white, red, yellow, green, gray]
 
     # Set game window width & height
     block_size_rows = (monitor_height - 100) // (grid.rows + 1) if grid.rows >= 20 else monitor_height // 60
@@ -112,24 +113,26 @@ def start_game_gui(grid: Grid, max_steps: int = 200, step_time: int = 300,
     step_waiting_time = 0
     simulation_total_time = 0
 
+    # Color indices of the cells currently drawn on the screen, -1 marks cells that were never drawn
+    drawn_color_nums = np.full((grid.rows, grid.cols), -1)
+
     # Game loop
     game_gui_running = True
     while game_gui_running:
 
-        # Draw the grid
-        for i in range(grid.rows):
-            for j in range(grid.cols):
-                color_num = grid.cells[i, j].cell_type.value
-                color = cell_colors[color_num]
-                if color_num == 0 and grid.cells[i, j].path:
-                    color = gray
-                    color_num = 4
-                # Remove old color
-                pygame.draw.rect(screen, blue, rects[i][j], 0)
-                # Put new color
-                pygame.draw.rect(screen, color, rects[i][j], 1 if color_num == 0 else 0, border_radius=1)
-                # Draw borders
-                pygame.draw.rect(screen, white, rects[i][j], 1)
+        # Get the current state of the grid at once and only redraw the cells whose color changed
+        color_nums = grid.to_array()
+        color_nums = np.where((color_nums == CellType.EMPTY.value) & grid.get_path(), 4, color_nums)
+        for i, j in np.argwhere(color_nums != drawn_color_nums):
+            color_num = color_nums[i, j]
+            color = cell_colors[color_num]
+            # Remove old color
+            pygame.draw.rect(screen, blue, rects[i][j], 0)
+            # Put new color
+            pygame.draw.rect(screen, color, rects[i][j], 1 if color_num == 0 else 0, border_radius=1)
+            # Draw borders
+            pygame.draw.rect(screen, white, rects[i][j], 1)
+        drawn_color_nums = color_nums
 
         # Simulate one step
         if grid.pedestrians and simulation_running and not simulation_done \
@@ -155,12 +158,15 @@ def start_game_gui(grid: Grid, max_steps: int = 200, step_time: int = 300,
                           f"Pedestrians Gone = {pedestrians - len(grid.pedestrians)}", green, blue)
             simulation_running = False
             simulation_done = True
+            # Write the measurements of the simulation to the log file
+            grid.close()
 
         # Handle events
         for event in pygame.event.get():
 
             # Close button
             if event.type == pygame.QUIT:
+                grid.close()
                 pygame.quit()
                 if simulation_done:
                     return simulation_total_time, steps
@@ -0,0 +1,216 @@
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:
+    # Without numba the kernels run as plain python. They give the same results, only slower.
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda function: function
+
+# Row and column offsets of the 8 neighbours of a cell. The first STRAIGHT_NEIGHBOURS entries are
+# the straight neighbours, the remaining ones the diagonal neighbours.
+NEIGHBOUR_ROWS = np.array([-1, 0, 0, 1, -1, -1, 1, 1])
+NEIGHBOUR_COLS = np.array([0, -1, 1, 0, -1, 1, -1, 1])
+STRAIGHT_NEIGHBOURS = 4
+
+# Every edge of the 8-connected grid is either a straight or a diagonal step, so only two lengths exist.
+STRAIGHT_STEP = 1.0
+DIAGONAL_STEP = 1.4142135623730951
+
+
+@njit(cache=True)
+def _heap_push(keys: np.ndarray, items: np.ndarray, size: int, key: float, item: int) -> int:
+    """
+    Pushes an item on the array backed binary heap.
+    :param keys: the keys of the heap entries
+    :param items: the items of the heap entries
+    :param size: current number of entries in the heap
+    :param key: key of the new entry
+    :param item: item of the new entry
+    :return: the new size of the heap
+    """
+    position = size
+    while position > 0:
+        parent = (position - 1) // 2
+        if keys[parent] <= key:
+            break
+        keys[position] = keys[parent]
+        items[position] = items[parent]
+        position = parent
+    keys[position] = key
+    items[position] = item
+    return size + 1
+
+
+@njit(cache=True)
+def _heap_pop(keys: np.ndarray, items: np.ndarray, size: int):
+    """
+    Removes the entry with the smallest key from the array backed binary heap.
+    :param keys: the keys of the heap entries
+    :param items: the items of the heap entries
+    :param size: current number of entries in the heap
+    :return: the key and the item of the removed entry and the new size of the heap
+    """
+    key, item = keys[0], items[0]
+    size -= 1
+    last_key, last_item = keys[size], items[size]
+    position = 0
+    while True:
+        child = 2 * position + 1
+        if child >= size:
+            break
+        if child + 1 < size and keys[child + 1] < keys[child]:
+            child += 1
+        if last_key <= keys[child]:
+            break
+        keys[position] = keys[child]
+        items[position] = items[child]
+        position = child
+    keys[position] = last_key
+    items[position] = last_item
+    return key, item, size
+
+
+@njit(cache=True)
+def dijkstra_kernel(cell_types: np.ndarray, costs: np.ndarray, obstacle: int) -> None:
+    """
+    Multi-source dijkstra's algorithm on the 8-connected grid.
+    Every cell with a finite cost (normally the targets with a cost of zero) is a source. The costs array is
+    updated in place so that each cell holds the distance to its closest source. Obstacles are never visited.
+    :param cell_types: 2D array with the type of each cell
+    :param costs: 2D float array with the initial costs of the cells
+    :param obstacle: the value of the obstacle cell type
+    :return: None
+    """
+    rows, cols = cell_types.shape
+    # Every visited cell pushes each of its 8 neighbours at most once, on top of the initial sources.
+    capacity = 9 * rows * cols + 1
+    keys = np.empty(capacity, dtype=np.float64)
+    items = np.empty(capacity, dtype=np.int64)
+    visited = np.zeros((rows, cols), dtype=np.bool_)
+    size = 0
+    for row in range(rows):
+        for col in range(cols):
+            if cell_types[row, col] != obstacle and costs[row, col] < np.inf:
+                size = _heap_push(keys, items, size, costs[row, col], row * cols + col)
+
+    while size > 0:
+        cost, cell_index, size = _heap_pop(keys, items, size)
+        row, col = cell_index // cols, cell_index % cols
+        if visited[row, col]:
+            continue
+        visited[row, col] = True
+        for k in range(NEIGHBOUR_ROWS.shape[0]):
+            i, j = row + NEIGHBOUR_ROWS[k], col + NEIGHBOUR_COLS[k]
+            if 0 <= i < rows and 0 <= j < cols and cell_types[i, j] != obstacle and not visited[i, j]:
+                dist = cost + (STRAIGHT_STEP if k < STRAIGHT_NEIGHBOURS else DIAGONAL_STEP)
+                if dist < costs[i, j]:
+                    costs[i, j] = dist
+                    size = _heap_push(keys, items, size, dist, i * cols + j)
+
+
+@njit(cache=True)
+def repulsion_kernel(cell_types: np.ndarray, first_pedestrian: np.ndarray, next_pedestrian: np.ndarray,
+                     pedestrian: int, row: int, col: int, stencil: np.ndarray, obstacle: int) -> float:
+    """
+    Sums the cost added to a cell by the pedestrians around it, the given pedestrian itself excluded.
+    The pedestrians are looked up in the spatial hash of the grid and their costs are added in the order of the
+    pedestrians list, so the sum is the same as adding the costs of all pedestrians one after the other.
+    :param cell_types: 2D array with the type of each cell
+    :param first_pedestrian: 2D int array with the index of one pedestrian on each cell, -1 for no pedestrian
+    :param next_pedestrian: index of the next pedestrian on the same cell for every pedestrian, -1 for the last one
+    :param pedestrian: index of the pedestrian that is excluded
+    :param row: row of the cell
+    :param col: column of the cell
+    :param stencil: 2D float array with the cost a pedestrian in its centre adds to the cells around it
+    :param obstacle: the value of the obstacle cell type
+    :return: the summed cost of the pedestrians
+    """
+    # Obstacles are not affected by pedestrians
+    if cell_types[row, col] == obstacle:
+        return 0.0
+    rows, cols = cell_types.shape
+    reach = stencil.shape[0] // 2
+    count = 0
+    for d_row in range(-reach, reach + 1):
+        for d_col in range(-reach, reach + 1):
+            i, j = row + d_row, col + d_col
+            if 0 <= i < rows and 0 <= j < cols and stencil[reach + d_row, reach + d_col] > 0:
+                other = first_pedestrian[i, j]
+                while other >= 0:
+                    if other != pedestrian:
+                        count += 1
+                    other = next_pedestrian[other]
+    if count == 0:
+        return 0.0
+
+    # Insertion sort of the costs by the index of their pedestrian
+    indices = np.empty(count, dtype=np.int64)
+    costs = np.empty(count, dtype=np.float64)
+    size = 0
+    for d_row in range(-reach, reach + 1):
+        for d_col in range(-reach, reach + 1):
+            i, j = row + d_row, col + d_col
+            if 0 <= i < rows and 0 <= j < cols and stencil[reach + d_row, reach + d_col] > 0:
+                other = first_pedestrian[i, j]
+                while other >= 0:
+                    if other != pedestrian:
+                        position = size
+                        while position > 0 and indices[position - 1] > other:
+                            indices[position] = indices[position - 1]
+                            costs[position] = costs[position - 1]
+                            position -= 1
+                        # The stencil is symmetric, the cost at the offset of the cell from the pedestrian is the same
+                        indices[position] = other
+                        costs[position] = stencil[reach + d_row, reach + d_col]
+                        size += 1
+                    other = next_pedestrian[other]
+    total = 0.0
+    for position in range(count):
+        total += costs[position]
+    return total
+
+
+@njit(cache=True)
+def best_neighbour_kernel(cell_types: np.ndarray, field: np.ndarray, next_to_target: np.ndarray,
+                          first_pedestrian: np.ndarray, next_pedestrian: np.ndarray, pedestrian: int,
+                          row: int, col: int, stencil: np.ndarray, target: int, obstacle: int):
+    """
+    Chooses the cell a pedestrian moves to next. A neighbouring target is always chosen, otherwise the cheapest
+    of the cell of the pedestrian and its neighbours wins. Ties go to the earlier candidate, i.e. the pedestrian
+    stays rather than moving and prefers straight over diagonal steps.
+    The cost of a candidate is its cost in the field plus the cost of the other pedestrians, see repulsion_kernel.
+    :param cell_types: 2D array with the type of each cell
+    :param field: 2D float array with the cost of each cell to reach a target
+    :param next_to_target: 2D bool array that marks the cells which have a target as neighbour
+    :param first_pedestrian: 2D int array with the index of one pedestrian on each cell, -1 for no pedestrian
+    :param next_pedestrian: index of the next pedestrian on the same cell for every pedestrian, -1 for the last one
+    :param pedestrian: index of the pedestrian that moves
+    :param row: row of the pedestrian
+    :param col: column of the pedestrian
+    :param stencil: 2D float array with the cost a pedestrian in its centre adds to the cells around it
+    :param target: the value of the target cell type
+    :param obstacle: the value of the obstacle cell type
+    :return: row and column of the chosen cell
+    """
+    rows, cols = cell_types.shape
+    # The mark may be outdated if a pedestrian left a target during this step, then no target is found.
+    if next_to_target[row, col]:
+        for k in range(NEIGHBOUR_ROWS.shape[0]):
+            i, j = row + NEIGHBOUR_ROWS[k], col + NEIGHBOUR_COLS[k]
+            if 0 <= i < rows and 0 <= j < cols and cell_types[i, j] == target:
+                return i, j
+
+    best_row, best_col = row, col
+    min_cost = field[row, col] + repulsion_kernel(cell_types, first_pedestrian, next_pedestrian, pedestrian,
+                                                  row, col, stencil, obstacle)
+    for k in range(NEIGHBOUR_ROWS.shape[0]):
+        i, j = row + NEIGHBOUR_ROWS[k], col + NEIGHBOUR_COLS[k]
+        if 0 <= i < rows and 0 <= j < cols:
+            cost = field[i, j] + repulsion_kernel(cell_types, first_pedestrian, next_pedestrian, pedestrian,
+                                                  i, j, stencil, obstacle)
+            if cost < min_cost:
+                best_row, best_col, min_cost = i, j, cost
+    return best_row, best_col
@@ -1,4 +1,7 @@
 import csv
+import hashlib
+import math
+from collections import deque
 from enum import Enum
 from pathlib import Path
 from random import seed
@@ -9,6 +12,32 @@ import numpy as np
 import scipy.interpolate as spi
 from matplotlib import colors
 
+from grid_kernels import NEIGHBOUR_COLS, NEIGHBOUR_ROWS, best_neighbour_kernel, dijkstra_kernel
+
+# (row, col) offsets of the 8 neighbours of a cell, the straight neighbours come before the diagonal ones.
+NEIGHBOUR_OFFSETS = tuple(zip(NEIGHBOUR_ROWS.tolist(), NEIGHBOUR_COLS.tolist()))
+
+# Pedestrians further away than this distance (in cells) do not add any cost to a cell.
+REPULSION_RADIUS = 1.5
+# Cells reach around a pedestrian that can be within the repulsion radius.
+REPULSION_REACH = int(REPULSION_RADIUS)
+# Cost a pedestrian adds to the cells around it, the pedestrian stands in the centre of the stencil.
+# A cell at distance r < REPULSION_RADIUS gets 1 / exp(r^2 - REPULSION_RADIUS^2), cells further away get nothing.
+# This is the only place where the repulsion cost function is evaluated.
+REPULSION_DISTANCES = np.sqrt(np.power(np.arange(-REPULSION_REACH, REPULSION_REACH + 1)[:, None], 2) +
+                              np.power(np.arange(-REPULSION_REACH, REPULSION_REACH + 1), 2))
+REPULSION_STENCIL = np.where(REPULSION_DISTANCES < REPULSION_RADIUS,
+                             1 / np.exp(REPULSION_DISTANCES * REPULSION_DISTANCES - REPULSION_RADIUS * REPULSION_RADIUS),
+                             0.0)
+
+# Cubic spline through the age vs speed graph of RiMEA figure 2, the ages are in years and the speeds in meter/second.
+AGE_SPEED_SPLINE = spi.splrep(np.arange(5, 85, 5),
+                              np.array([0.75, 1.23, 1.48, 1.65, 1.60, 1.55, 1.51, 1.49, 1.45, 1.42, 1.34, 1.25, 1.17,
+                                        1.05, 0.93, 0.67]), k=3)
+# Ages drawn by Grid.flood_pedestrians (MAX_AGE exclusive) and their speeds evaluated once from the spline.
+MIN_AGE, MAX_AGE = 18, 80
+AGE_SPEEDS = spi.splev(np.arange(MIN_AGE, MAX_AGE), AGE_SPEED_SPLINE)
+
 
 class CellType(Enum):
     """
@@ -20,41 +49,85 @@ class CellType(Enum):
     TARGET = 3
 
 
+# Plain integer values of the cell types. Hot loops compare these with the cell_types array of the grid
+# instead of going through the CellType members and their .value attribute.
+EMPTY = CellType.EMPTY.value
+PEDESTRIAN = CellType.PEDESTRIAN.value
+OBSTACLE = CellType.OBSTACLE.value
+TARGET = CellType.TARGET.value
+# The CellType members indexed by their value, a plain lookup instead of the value search of CellType(value)
+CELL_TYPES = tuple(sorted(CellType, key=lambda cell_type: cell_type.value))
+
+
 class Cell:
     """
     Cell class represents one cell in the grid. A cell can be a target, an obstacle, a pedestrian
     (if occupied by a pedestrian) or empty.
+    The type, the costs and the path flag of the cell are not stored in the cell itself but in the arrays of
+    its grid (cell_types, distance_to_target, dijkstra_cost and path), the cell is a view on them.
     """
+    # A grid holds one cell per position, slots keep these many small objects without a __dict__
+    __slots__ = ('grid', 'row', 'col')
 
-    def __init__(self, row: int, col: int, cell_type: CellType = CellType.EMPTY,
-                 obstacle_avoidance: bool = True):
+    def __init__(self, grid, row: int, col: int):
         """
-        Initiate the cell with the given position to an empty cell
+        Initiate the cell with the given position. The state of the cell is read from the grid.
+        :param grid: the grid the cell belongs to
         :param row: represents the cell position in the y-axis
         :param col: represents the cell position in the x-axis
-        :param cell_type: the type of the cell
-        :param obstacle_avoidance: if false, obstacles are ignored
         """
         super().__init__()
+        self.grid = grid
         self.row: int = row
         self.col: int = col
-        self.cell_type: CellType = cell_type
 
-        # If obstacle avoidance is True then the obstacle cells have a very high (inf) cost
-        # (given in distance_to_target) otherwise they have the same cost.
-        if obstacle_avoidance:
-            self.distance_to_target: float = np.inf \
-                if self.cell_type.value == CellType.OBSTACLE.value else 0
-        else:
-            self.distance_to_target: float = 0
+    @property
+    def cell_type(self) -> CellType:
+        """
+        :return: the type of the cell as stored in the cell_types array of the grid
+        """
+        return CELL_TYPES[self.grid.cell_types[self.row, self.col]]
+
+    @cell_type.setter
+    def cell_type(self, cell_type: CellType):
+        """
+        Stores the type of the cell in the cell_types array of the grid
+        :param cell_type: the new type of the cell
+        """
+        self.grid.cell_types[self.row, self.col] = cell_type.value
+
+    @property
+    def distance_to_target(self) -> float:
+        """
+        :return: the euclidean distance of the cell to the closest target as stored in the grid
+        """
+        return self.grid.distance_to_target[self.row, self.col]
+
+    @distance_to_target.setter
+    def distance_to_target(self, distance: float):
+        self.grid.distance_to_target[self.row, self.col] = distance
 
-        # Neighbours are divided into straight and diagonal to take care of distances.
-        self.straight_neighbours: list = []
-        self.diagonal_neighbours: list = []
-        self.dijkstra_cost: float = 0 if self.cell_type.value == CellType.TARGET.value else np.inf
+    @property
+    def dijkstra_cost(self) -> float:
+        """
+        :return: the dijkstra cost of the cell as stored in the grid
+        """
+        return self.grid.dijkstra_cost[self.row, self.col]
+
+    @dijkstra_cost.setter
+    def dijkstra_cost(self, cost: float):
+        self.grid.dijkstra_cost[self.row, self.col] = cost
 
-        # This attribute is used to plot the trajectory of pedestrians.
-        self.path: bool = False
+    @property
+    def path(self) -> bool:
+        """
+        :return: true if the cell was part of the trajectory of a pedestrian
+        """
+        return self.grid.path[self.row, self.col]
+
+    @path.setter
+    def path(self, path: bool):
+        self.grid.path[self.row, self.col] = path
 
     def get_distance(self, other_cell, obstacle_avoidance: bool = True) -> float:
         """
@@ -64,38 +137,36 @@ class Cell:
         :return: euclidean distance as a float
         """
 
-        if obstacle_avoidance and self.cell_type.value == CellType.OBSTACLE.value:
+        if obstacle_avoidance and self.grid.cell_types[self.row, self.col] == OBSTACLE:
             return np.inf
         else:
-            return np.sqrt(np.power(self.row - other_cell.row, 2) + np.power(self.col - other_cell.col, 2))
+            return math.hypot(self.row - other_cell.row, self.col - other_cell.col)
 
-    def cost_to_pedestrian(self, ped, r_max: float = 1.5) -> float:
+    def cost_to_pedestrian(self, ped) -> float:
         """
         get cost added by a pedestrian to a cell based on the repulsion cost function.
+        The cost is looked up in REPULSION_STENCIL.
 
         :param ped: A pedestrian with respect to whom to calculate the distance cost
-        :param r_max: Maximum distance to start avoiding other pedestrians
         :return: the cost calculated based on the distance to the pedestrian
         """
-        r: float = self.get_distance(ped.cell)
-        if r >= r_max:
+        # Obstacles are not affected by pedestrians
+        if self.grid.cell_types[self.row, self.col] == OBSTACLE:
             return 0
-        else:
-            # return np.exp(1 / (r * r - r_max * r_max))
-            return 1 / np.exp(r * r - r_max * r_max)
+        d_row, d_col = self.row - ped.cell.row, self.col - ped.cell.col
+        if abs(d_row) > REPULSION_REACH or abs(d_col) > REPULSION_REACH:
+            return 0
+        return REPULSION_STENCIL[d_row + REPULSION_REACH, d_col + REPULSION_REACH]
 
     def check_if_neighbour_is_target(self) -> bool:
         """
         Checks if the neighbours of a cell are a target.
         :return: True if a target is the neighbour otherwise False
         """
-        for neighbour in self.straight_neighbours:
-            if neighbour.cell_type.value == CellType.TARGET.value:
-                return True
-        for neighbour in self.diagonal_neighbours:
-            if neighbour.cell_type.value == CellType.TARGET.value:
-                return True
-        return False
+        cell_types = self.grid.cell_types
+        # Count the targets in the 3x3 window around the cell in one comparison, the cell itself does not count
+        window = cell_types[max(self.row - 1, 0):self.row + 2, max(self.col - 1, 0):self.col + 2]
+        return bool(np.count_nonzero(window == TARGET) > (cell_types[self.row, self.col] == TARGET))
 
     def __str__(self):
         """
@@ -103,22 +174,6 @@ class Cell:
         """
         return f"Cell ({self.row}, {self.col}) Type = {self.cell_type}"
 
-    def __eq__(self, other_cell):
-        """
-        Compares if two cells are the same.
-        :param other_cell: Cell Type object
-        :return: True if cells are the same else false
-        """
-        return self.row == other_cell.row and self.col == other_cell.col
-
-    def __ge__(self, other_cell):
-        """
-        Compares if a certain cell is closer to the target compared to another
-        :param other_cell: Cell Type object
-        :return: True if invoking cells is closer to target than the other cell
-        """
-        return self.distance_to_target >= other_cell.distance_to_target
-
 
 class Pedestrian:
     """
@@ -126,6 +181,7 @@ class Pedestrian:
     The cell is updated after every step based on a utility function.
     """
     _id_counter: int = 0
+    __slots__ = ('id', 'cell', 'index', 'age', 'row', 'col', 'speed', 'delay', 'steps', 'last_move', 'last_10_steps')
 
     def __init__(self, cell: Cell, speed: float = 1.33, age: int = 20):
         """
@@ -142,6 +198,7 @@ class Pedestrian:
         super().__init__()
         Pedestrian._id_counter += 1
         self.id: int = Pedestrian._id_counter  # ID Unique to each pedestrian
+        self.index: int = -1  # Row of the pedestrian in Grid.pedestrian_positions
         self.cell: Cell = cell  # The cell a pedestrian occupies
         self.age: int = age  # age of the pedestrian
         self.row: float = 0
@@ -150,15 +207,15 @@ class Pedestrian:
         self.delay: int = 1000.0 // speed
         self.steps: int = 0
         self.last_move: int = 0  # Time when the last step was made
-        self.last_10_steps = []  # Stores the last 10 cells visited along with the time at which they were visited
-        # to calculate pedestrian speed
+        # Stores the last 10 cells visited along with the time at which they were visited to calculate pedestrian speed
+        self.last_10_steps = deque(maxlen=10)
 
     def is_valid(self) -> bool:
         """
         Checks that the cell where the pedestrian is standing is a pedestrian cell.
         :return: true or false
         """
-        return self.cell.cell_type.value == CellType.PEDESTRIAN.value
+        return self.cell.grid.cell_types[self.cell.row, self.cell.col] == PEDESTRIAN
 
     def update_cell(self, new_cell: Cell):
         """
@@ -168,10 +225,8 @@ class Pedestrian:
         :param new_cell: The cell to move to
         :return: None
         """
-        self.cell.cell_type = CellType.EMPTY
+        self.cell.grid.cell_types[self.cell.row, self.cell.col] = EMPTY
         self.cell.path = True
-        if len(self.last_10_steps) >= 10:
-            self.last_10_steps.pop(0)
         self.cell = new_cell
 
     def move(self, cell: Cell, constant_speed: bool = True,
@@ -202,7 +257,7 @@ class Pedestrian:
                 full_col = self.col + (cell.col - self.cell.col) * 0.71
                 # remove the potential 1 from self.row & self.col keeping the sign
                 #   if a diagonal step can be made
-                if np.abs(full_row) >= 1 and np.abs(full_col) >= 1:
+                if abs(full_row) >= 1 and abs(full_col) >= 1:
                     self.row = (full_row % 1.0) * np.sign(full_row)
                     self.col = (full_col % 1.0) * np.sign(full_col)
                 else:
@@ -226,22 +281,16 @@ class Pedestrian:
         # Scale the distance according to cell_scale
         # get the speed by dividing distance / (last_time - first_time)
 
-        distance = 0
-        last_steps = np.array(self.last_10_steps)
+        last_steps = self.last_10_steps
         if len(last_steps) <= 2:
             return 0
-        initial_time = last_steps[0, 1]
-        final_time = last_steps[-1, 1]
-        first_cell = last_steps[0, 0]
+        initial_time = last_steps[0][1]
+        final_time = last_steps[-1][1]
         time = (final_time - initial_time) * cell_scale
-        for step in range(1, len(last_steps)):
-            if last_steps[step, 0].row != first_cell.row and last_steps[step, 0].col != first_cell.col:
-                # diagonal step
-                distance += 1.42
-            else:
-                # straight step
-                distance += 1.0
-            first_cell = last_steps[step, 0]
+        # A step is diagonal if both the row and the column changed, otherwise it is a straight step
+        positions = np.array([(cell.row, cell.col) for cell, _ in last_steps])
+        changed = positions[1:] != positions[:-1]
+        distance = np.where(changed[:, 0] & changed[:, 1], 1.42, 1.0).sum()
         if time > 0:
             return distance * cell_scale / (time / 1000)
         else:
@@ -253,6 +302,72 @@ class Pedestrian:
     def __eq__(self, other_ped):
         return self.id == other_ped.id
 
+    def __hash__(self):
+        return self.id
+
+
+class GridCells:
+    """
+    The cells of a grid, indexed like a 2D array with grid.cells[row, col].
+    The state of the grid lives in its arrays, so a Cell is only created when a position is accessed for the first
+    time. Later accesses return the same Cell object.
+    """
+    __slots__ = ('grid', 'shape', '__cells')
+
+    def __init__(self, grid):
+        """
+        :param grid: the grid the cells belong to
+        """
+        self.grid = grid
+        self.shape = (grid.rows, grid.cols)
+        self.__cells = {}
+
+    def __getitem__(self, position) -> Cell:
+        """
+        :param position: (row, col) of the cell, negative values count from the end as for numpy arrays.
+                         A single row index gives the whole row, so grid.cells[row][col] works as well.
+        :return: the cell at the given position or the list of cells in the given row
+        """
+        try:
+            cell = self.__cells.get(position)
+        except TypeError:
+            # Unhashable keys such as slices, they are rejected below
+            cell = None
+        if cell is None:
+            if isinstance(position, (int, np.integer)):
+                return self.__row(position)
+            if not (isinstance(position, tuple) and len(position) == 2
+                    and all(isinstance(index, (int, np.integer)) for index in position)):
+                raise TypeError(f"grid cells are indexed with a row or a (row, col) pair of integers, "
+                                f"slices are not supported, got {position!r}")
+            row, col = int(position[0]), int(position[1])
+            if not (-self.shape[0] <= row < self.shape[0] and -self.shape[1] <= col < self.shape[1]):
+                raise IndexError(f"cell ({row}, {col}) is out of bounds for a grid of shape {self.shape}")
+            row, col = row % self.shape[0], col % self.shape[1]
+            cell = self.__cells.setdefault((row, col), Cell(self.grid, row, col))
+        return cell
+
+    def __row(self, row: int) -> list:
+        """
+        :param row: index of the row, negative values count from the end
+        :return: list of the cells in the row
+        """
+        if not -self.shape[0] <= row < self.shape[0]:
+            raise IndexError(f"row {row} is out of bounds for a grid of shape {self.shape}")
+        return [self[row, col] for col in range(self.shape[1])]
+
+    def __iter__(self):
+        """
+        Iterates over the rows like a 2D array, every row is a list of cells.
+        """
+        return (self.__row(row) for row in range(self.shape[0]))
+
+    def __len__(self) -> int:
+        """
+        :return: the number of rows
+        """
+        return self.shape[0]
+
 
 class Grid:
     """
@@ -262,47 +377,120 @@ class Grid:
     #######################################################################################################
     # Initialization functions
     #######################################################################################################
-    def __init__(self, rows: int, cols: int, cells: np.ndarray = None,
-                 cell_scale: float = 1.0):
+    def __init__(self, rows: int, cols: int, cell_types: np.ndarray = None,
+                 cell_scale: float = 1.0, obstacle_avoidance: bool = True):
         """
         Set up basic attributes for the GUI object
         :param rows: row size of grid
         :param cols: column size of grid
-        :param cells: np array of objects of type Cell that constitute the entire grid
+        :param cell_types: np array with the type of each cell following the encoding of Grid.to_array
         :param cell_scale: Size of each cell in meters.
+        :param obstacle_avoidance: if false, all obstacles are ignored
         """
         super().__init__()
 
-        # -> This is a list of numpy arrays of all the past states of
-        # the grid starting from the initial state
-        # self.past_pedestrian_states = []
-        self.past_states = []
-
         self.rows: int = rows
         self.cols: int = cols
         self.cell_scale: float = cell_scale
         self.time_step: int = 0
 
+        # -> The past states of the grid starting from the initial state are stored as uint8 frames
+        # in a preallocated buffer, see Grid.past_states
+        self.__states = np.empty((0, rows, cols), dtype=np.uint8)
+        self.__state_count = 0
+
         # Attributes used for visualization and animation
         # Standard colormap to homogenize all visualizations
         self.cmap = colors.ListedColormap(['blue', 'red', 'yellow', 'green'])
         self.animation = None
-        # Construct an empty grid if the cells are not provided.
-        if cells is None:
-            self.cells = np.asarray([[Cell(row, column) for column in range(cols)] for row in range(rows)])
+        # The types of all cells are stored in a single uint8 array. Construct an empty grid if they are not provided.
+        if cell_types is None:
+            self.cell_types = np.zeros((rows, cols), dtype=np.uint8)
         else:
-            self.cells = cells
-
-        # Fill the cells with their attributes straight_neighbours and diagonal_neighbours based on the grid state.
-        self.assign_neighbours()
-
-        self.pedestrians = [Pedestrian(cell) for row in self.cells
-                            for cell in row if cell.cell_type.value == 1]
-        self.initial_state = self.cells.copy()
+            self.cell_types = np.array(cell_types, dtype=np.uint8)
+        # The state of the cells is stored in one array per attribute, the Cell objects are views on them.
+        # If obstacle avoidance is True then the obstacle cells have a very high (inf) cost
+        # (given in distance_to_target) otherwise they have the same cost.
+        if obstacle_avoidance:
+            self.distance_to_target = np.where(self.cell_types == OBSTACLE, np.inf, 0.0)
+        else:
+            self.distance_to_target = np.zeros((rows, cols))
+        self.dijkstra_cost = np.where(self.cell_types == TARGET, 0.0, np.inf)
+        # Marks the cells that were part of the trajectory of a pedestrian.
+        self.path = np.zeros((rows, cols), dtype=bool)
+        # The cells are created on first access, the arrays above are all that is allocated per cell
+        self.cells = GridCells(self)
+
+        self.pedestrians = [Pedestrian(self.cells[row, col]) for row, col in np.argwhere(self.cell_types == PEDESTRIAN)]
+        # (row, col) of every pedestrian, row i belongs to self.pedestrians[i]. It is kept in sync with the
+        # pedestrians so that position queries over all pedestrians are plain numpy indexing.
+        # The buffer has room for more pedestrians than it holds, see Grid.pedestrian_positions
+        self.__positions = np.empty((0, 2), dtype=np.int32)
+        # Spatial hash of the pedestrians as linked lists in arrays, it is used to look up the pedestrians around
+        # a cell without scanning all pedestrians. first_pedestrian holds the index of one pedestrian on each cell
+        # and next_pedestrian the index of the next pedestrian on the same cell, -1 ends a list.
+        # next_pedestrian has the same capacity as the buffer of the positions.
+        self.first_pedestrian = np.full((rows, cols), -1, dtype=np.int64)
+        self.next_pedestrian = np.empty(0, dtype=np.int64)
+        self.index_pedestrians()
+        # The cells are views on the arrays of the grid, so they are the same objects in every state
+        self.initial_state = self.cells
 
         # Store the points where measurements for pedestrian speed and density should be taken.
         # This can be filled by calling Grid.add_measuring_point
         self.measuring_points = []
+        # (row, col) of the measuring points for constant time lookups in Grid.update_grid
+        self.measuring_coords = set()
+        # Bounds of the square around each measuring point and its scaled area, keyed by (row, col).
+        # They only depend on the grid size, so they are computed once by Grid.measuring_window
+        self.measuring_windows = {}
+        # Log file of the measurements and its csv writer, opened by Grid.document_measures and closed by Grid.close
+        self.measures_log = None
+        self.measures_writer = None
+        # Path of the log file, separate simulations can write to separate files
+        self.measures_path = "./logs/measuring_points_logs.csv"
+
+        # Marks the cells that have a target as neighbour. It is refreshed by Grid.update_grid
+        self.next_to_target = self.get_target_neighbourhood()
+
+        # Results of Grid.fill_distances and Grid.flood_dijkstra keyed by the layout of the targets (and obstacles)
+        # they were computed for. Pedestrians do not change these costs, so repeated runs can reuse them.
+        self.cost_cache = {}
+
+    @property
+    def pedestrian_positions(self) -> np.ndarray:
+        """
+        :return: numpy array of shape (pedestrians, 2) with the (row, col) of every pedestrian
+        """
+        return self.__positions[:len(self.pedestrians)]
+
+    @property
+    def past_states(self) -> np.ndarray:
+        """
+        :return: numpy array of shape (steps, rows, cols) with all the past states of the grid
+        """
+        return self.__states[:self.__state_count]
+
+    def __reset_states(self, capacity: int = 0) -> None:
+        """
+        Drops all past states and allocates a new buffer for them.
+        :param capacity: number of states the buffer can hold before it has to grow
+        :return: None
+        """
+        self.__states = np.empty((capacity, self.rows, self.cols), dtype=np.uint8)
+        self.__state_count = 0
+
+    def __record_state(self) -> None:
+        """
+        Copies the current cell types into the buffer of past states. The buffer doubles its size when it is full.
+        :return: None
+        """
+        if self.__state_count == len(self.__states):
+            states = np.empty((max(2 * len(self.__states), 16), self.rows, self.cols), dtype=np.uint8)
+            states[:self.__state_count] = self.__states
+            self.__states = states
+        self.__states[self.__state_count] = self.cell_types
+        self.__state_count += 1
 
     def set_cell_scale(self, cell_scale: float = 1):
         """
@@ -312,26 +500,70 @@ class Grid:
         """
         self.cell_scale = cell_scale
 
-    def assign_neighbours(self):
+    def get_target_neighbourhood(self) -> np.ndarray:
+        """
+        Marks all cells that have a target as neighbour, the vectorized version of Cell.check_if_neighbour_is_target.
+        :return: boolean numpy array that is true for the cells next to a target
+        """
+        is_target = self.cell_types == TARGET
+        next_to_target = np.zeros((self.rows, self.cols), dtype=bool)
+        for d_row, d_col in NEIGHBOUR_OFFSETS:
+            # A cell is next to a target if the cell at (row + d_row, col + d_col) is a target
+            next_to_target[max(-d_row, 0):self.rows - max(d_row, 0), max(-d_col, 0):self.cols - max(d_col, 0)] |= \
+                is_target[max(d_row, 0):self.rows - max(-d_row, 0), max(d_col, 0):self.cols - max(-d_col, 0)]
+        return next_to_target
+
+    def index_pedestrians(self) -> None:
+        """
+        Numbers the pedestrians in the order of the pedestrians list and rebuilds the spatial hash that links the
+        pedestrians standing on the same cell and the array of pedestrian positions.
+        :return: None
+        """
+        self.__positions = np.empty((len(self.pedestrians), 2), dtype=np.int32)
+        self.first_pedestrian.fill(-1)
+        self.next_pedestrian = np.empty(len(self.pedestrians), dtype=np.int64)
+        for index, ped in enumerate(self.pedestrians):
+            self.__positions[index] = ped.cell.row, ped.cell.col
+            ped.index = index
+            self.__link_pedestrian(ped)
+
+    def __link_pedestrian(self, ped: Pedestrian) -> None:
         """
-        This function assign a list to each cell. The list contains coordinates of cell's neighbors
-        We divide neighbors into two parts. One part we name it straight_neighbors, 
-        which include horizontal and vertical neighbors. Another includes diagonal neighbors.
-        This is done in order to cater to speed of pedestrians.
+        Puts a pedestrian in front of the list of pedestrians on its cell in first_pedestrian and next_pedestrian.
+        :param ped: the pedestrian to add
+        :return: None
+        """
+        row, col = ped.cell.row, ped.cell.col
+        self.next_pedestrian[ped.index] = self.first_pedestrian[row, col]
+        self.first_pedestrian[row, col] = ped.index
 
+    def __unlink_pedestrian(self, ped: Pedestrian) -> None:
+        """
+        Removes a pedestrian from the list of pedestrians on its cell in first_pedestrian and next_pedestrian.
+        :param ped: the pedestrian to remove
+        :return: None
+        """
+        position = (ped.cell.row, ped.cell.col)
+        if self.first_pedestrian[position] == ped.index:
+            self.first_pedestrian[position] = self.next_pedestrian[ped.index]
+        else:
+            other = self.first_pedestrian[position]
+            while self.next_pedestrian[other] != ped.index:
+                other = self.next_pedestrian[other]
+            self.next_pedestrian[other] = self.next_pedestrian[ped.index]
+
+    def __move_pedestrian(self, ped: Pedestrian, cell: Cell) -> None:
+        """
+        Moves the pedestrian to the given cell and keeps the spatial hash and the positions of the pedestrians
+        up to date.
+        :param ped: the pedestrian to move
+        :param cell: the cell to move to
+        :return: None
         """
-        for row in range(self.rows):
-            for col in range(self.cols):
-                column_list = [col - 1, col, col + 1]
-                row_list = [row - 1, row, row + 1]
-                for i in row_list:
-                    for j in column_list:
-                        if (0 <= i <= self.rows - 1) and (0 <= j <= self.cols - 1):
-                            if (i - row) * (j - col) == 0:
-                                self.cells[row][col].straight_neighbours.append(self.cells[i, j])
-                            else:
-                                self.cells[row][col].diagonal_neighbours.append(self.cells[i, j])
-                self.cells[row][col].straight_neighbours.remove(self.cells[row, col])
+        self.__unlink_pedestrian(ped)
+        ped.update_cell(cell)
+        self.__positions[ped.index] = cell.row, cell.col
+        self.__link_pedestrian(ped)
 
     def change_cell_type(self, row: int, col: int) -> None:
         """
@@ -343,20 +575,29 @@ class Grid:
         :param col: column index
         :return: None
         """
-        old_cell_type: np.short = np.short(self.cells[row, col].cell_type.value)
-        new_cell_type: np.short = np.short((old_cell_type + 1) % 4)
-
-        self.cells[row, col].cell_type = CellType(new_cell_type)
-        # Update the pedestrians list
-        if old_cell_type == 1 or new_cell_type == 1:
-            self.pedestrians = [Pedestrian(cell) for row in self.cells
-                                for cell in row if cell.cell_type.value == 1]
+        old_cell_type: int = int(self.cell_types[row, col])
+        new_cell_type: int = (old_cell_type + 1) % 4
+
+        self.cell_types[row, col] = new_cell_type
+        # Update the pedestrians list. Only the pedestrian on this cell is removed or added, the other
+        # pedestrians keep their state.
+        if old_cell_type == PEDESTRIAN:
+            # The pedestrians on this cell are found in the spatial hash
+            leaving = set()
+            index = self.first_pedestrian[row, col]
+            while index >= 0:
+                leaving.add(int(index))
+                index = self.next_pedestrian[index]
+            self.pedestrians = [ped for ped in self.pedestrians if ped.index not in leaving]
+            self.index_pedestrians()
+        if new_cell_type == PEDESTRIAN:
+            self.add_pedestrian(row, col)
 
         if old_cell_type > 1 or new_cell_type > 1:
-            self.cells[row, col].distance_to_target = np.inf \
-                if new_cell_type == CellType.OBSTACLE.value else 0
-            self.cells[row, col].dijkstra_cost = 0 \
-                if new_cell_type == CellType.TARGET.value else np.inf
+            self.distance_to_target[row, col] = np.inf \
+                if new_cell_type == OBSTACLE else 0
+            self.dijkstra_cost[row, col] = 0 \
+                if new_cell_type == TARGET else np.inf
 
     def flood_pedestrians(self, density: float, distributed_speed: bool = False):
         """
@@ -375,43 +616,43 @@ class Grid:
             no_of_pedestrians = int(density * grid_area)
             print("Adding", no_of_pedestrians, "to the grid.")
             seed(np.random.randint(0, 10))
+            # Draw all positions at once from the empty cells, so no two pedestrians share a cell
+            empty_cells = np.flatnonzero(self.cell_types == EMPTY)
+            if no_of_pedestrians > len(empty_cells):
+                print("Only", len(empty_cells), "empty cells are available.")
+                no_of_pedestrians = len(empty_cells)
+            chosen_cells = np.random.choice(empty_cells, size=no_of_pedestrians, replace=False)
+            rand_rows, rand_cols = np.unravel_index(chosen_cells, (self.rows, self.cols))
             if distributed_speed:
-                for ped in range(no_of_pedestrians):
-                    # Draw the age of the pedestrian from a uniform distribution and calculate the corresponding speed
-                    # from the age vs speed interpolation which is implemented in age_speed_distribution method,
-                    ped_age = np.random.randint(18, 80)
-                    rand_row = np.random.randint(0, self.rows)
-                    rand_col = np.random.randint(0, self.cols)
-                    while self.cells[rand_row, rand_col].cell_type.value != CellType.EMPTY.value:
-                        rand_row = np.random.randint(0, self.rows)
-                        rand_col = np.random.randint(0, self.cols)
-                    self.add_pedestrian(rand_row, rand_col, speed=self.__age_speed_distribution(ped_age), age=ped_age)
+                # Draw the age of the pedestrian from a uniform distribution and calculate the corresponding speed
+                # from the age vs speed interpolation which is implemented in age_speed_distribution method,
+                ped_ages = np.random.randint(MIN_AGE, MAX_AGE, size=no_of_pedestrians)
+                ped_speeds = self.__age_speed_distribution(ped_ages)
+                self.pedestrians.extend(Pedestrian(self.cells[rand_row, rand_col], speed=ped_speed, age=ped_age)
+                                        for rand_row, rand_col, ped_age, ped_speed
+                                        in zip(rand_rows, rand_cols, ped_ages, ped_speeds))
             else:
-                # We multiply the scaling factor to get the area in meters
-                for ped in range(no_of_pedestrians):
-                    rand_row = np.random.randint(0, self.rows)
-                    rand_col = np.random.randint(0, self.cols)
-                    while self.cells[rand_row, rand_col].cell_type.value != CellType.EMPTY.value:
-                        rand_row = np.random.randint(0, self.rows)
-                        rand_col = np.random.randint(0, self.cols)
-                    self.add_pedestrian(rand_row, rand_col, speed=1.33)
+                self.pedestrians.extend(Pedestrian(self.cells[rand_row, rand_col], speed=1.33)
+                                        for rand_row, rand_col in zip(rand_rows, rand_cols))
+            # All new pedestrians are indexed at once instead of growing the index per pedestrian
+            self.cell_types[rand_rows, rand_cols] = PEDESTRIAN
+            self.index_pedestrians()
 
-    def __age_speed_distribution(self, age: int) -> float:
+    def __age_speed_distribution(self, age):
         """
         Using cubic spline, we formed an interpolator function that takes the age as the input and returns the pedestrian
-        speed.
-        :param age: Age of the pedestrian
-        :return: Speed of the pedestrian
+        speed. The speeds of the ages drawn by Grid.flood_pedestrians are looked up in AGE_SPEEDS.
+        :param age: Age of the pedestrian or numpy array with the ages of many pedestrians
+        :return: Speed of the pedestrian or numpy array with the speeds of the pedestrians
         """
         if age is None:
             print("Error")
+            return None
+        ages = np.asarray(age)
+        if np.issubdtype(ages.dtype, np.integer) and ((ages >= MIN_AGE) & (ages < MAX_AGE)).all():
+            return AGE_SPEEDS[ages - MIN_AGE]
         else:
-            input_x = np.arange(5, 85, 5)
-            y = [0.75, 1.23, 1.48, 1.65, 1.60, 1.55, 1.51, 1.49, 1.45, 1.42, 1.34, 1.25, 1.17, 1.05, 0.93, 0.67]
-            output_y = np.array(y)
-            coeff = spi.splrep(input_x, output_y, k=3)
-            speed = spi.splev(age, coeff)
-            return speed
+            return spi.splev(ages, AGE_SPEED_SPLINE)
 
     #######################################################################################################
     # Flood cost values functions
@@ -422,108 +663,79 @@ class Grid:
         :param obstacle_avoidance: Obstacle avoidance can be turned off with a simple bool. Normally it is on.
         :return: None
         """
-        targets = [cell for row in self.cells
-                   for cell in row if cell.cell_type.value == 3]
-        for row in self.cells:
-            for cell in row:
-                min_dist = np.inf
-                for target in targets:
-                    distance = cell.get_distance(target, obstacle_avoidance)
-                    if distance < min_dist:
-                        cell.distance_to_target = distance
-                        min_dist = distance
+        targets = np.argwhere(self.cell_types == TARGET)
+        if len(targets) == 0:
+            return
+        key = ("distances", self.__layout_key(TARGET))
+        if key not in self.cost_cache:
+            # Squared distance of every cell to every target in one broadcast, reduced to the closest target.
+            # The square root is monotonic, so it is only taken once per cell after the reduction.
+            rows_idx, cols_idx = np.indices((self.rows, self.cols))
+            d_rows = rows_idx[:, :, None] - targets[:, 0]
+            d_cols = cols_idx[:, :, None] - targets[:, 1]
+            self.cost_cache[key] = np.sqrt((d_rows * d_rows + d_cols * d_cols).min(axis=2))
+        distances = self.cost_cache[key]
+        # Obstacles keep their distance when they are avoided
+        update = self.cell_types != OBSTACLE if obstacle_avoidance else np.ones((self.rows, self.cols), dtype=bool)
+        self.distance_to_target[update] = distances[update]
 
     def flood_dijkstra(self):
         """
         This function uses dijkstra's algorithm to floor all the cells that are part of the grid with a
         cost value as defined by the dijkstra's algorithm.
 
-        We need to run the dijkstra's algorithm for each target since we would like to cater to multiple
-        targets as well. Unlike the normal algorithm, in this case we take the target as the source (since we
-        wish the distance at the target to be zero) and the pedestrian as the destination.
+        All targets are used as sources at the same time (multi-source dijkstra), since we wish the distance at
+        the targets to be zero and every other cell to hold the distance to its closest target. Unlike the normal
+        algorithm, the target is the source and the pedestrian is the destination.
+        The algorithm itself runs in the compiled grid_kernels.dijkstra_kernel on plain numpy arrays.
         :return: None
         """
-        unvisited_cells = [cell for cell in self.cells.flatten() if
-                           cell.cell_type.value is not CellType.OBSTACLE.value]
-        # Once this list is empty the algorithm is complete
-        while unvisited_cells:  # While the unvisited_cells is not empty
-            cell_to_visit = min(unvisited_cells, key=lambda x: x.dijkstra_cost)
-            for straight_neighbour in cell_to_visit.straight_neighbours:
-                if straight_neighbour.cell_type.value != CellType.OBSTACLE.value \
-                        and straight_neighbour in unvisited_cells:
-                    dist = cell_to_visit.dijkstra_cost + cell_to_visit.get_distance(straight_neighbour)
-                    if dist < straight_neighbour.dijkstra_cost:
-                        straight_neighbour.dijkstra_cost = dist
-            for diagonal_neighbour in cell_to_visit.diagonal_neighbours:
-                if diagonal_neighbour.cell_type.value != CellType.OBSTACLE.value \
-                        and diagonal_neighbour in unvisited_cells:
-                    dist = cell_to_visit.dijkstra_cost + cell_to_visit.get_distance(diagonal_neighbour)
-                    if dist < diagonal_neighbour.dijkstra_cost:
-                        diagonal_neighbour.dijkstra_cost = dist
-            unvisited_cells.remove(cell_to_visit)
+        key = ("dijkstra", self.__layout_key(OBSTACLE, TARGET))
+        if key not in self.cost_cache:
+            # Seed the flood with the current targets only, so costs left over from an earlier flood
+            # (e.g. before a target was removed in the GUI) do not act as additional sources.
+            costs = np.where(self.cell_types == TARGET, 0.0, np.inf)
+            dijkstra_kernel(self.cell_types, costs, OBSTACLE)
+            self.cost_cache[key] = costs
+        # The cells of the grid write to their costs, so the cached array is copied
+        self.dijkstra_cost = self.cost_cache[key].copy()
 
-    #######################################################################################################
-    # Simulation functions
-    #######################################################################################################
-    def __pedestrians_costs(self, p1: Pedestrian, neighbor: Cell) -> float:
+    def __layout_key(self, *cell_types: int) -> bytes:
         """
-        calculate the sum of costs due to all other pedestrians on the specific  cell
-        :param p1: the pedestrian for which the neighbouring cell pedestrian cost is being calculated
-        :param neighbor: the neighbouring cell in question
-        :return: cost of the neighbouring cell due to pedestrians. Note the intrinsic cost is separate
+        Fingerprints where the cells of the given types are. Grids with the same key have the same cost fields.
+        :param cell_types: the cell types whose layout matters
+        :return: digest of the masks of the cell types
         """
-        costs = 0
-        for p2 in self.pedestrians:
-            if p2 != p1:
-                costs += neighbor.cost_to_pedestrian(p2)
-        return costs
-
-    def __get_cell_cost(self, dijkstra, ped, cell):
-        """
-        get the total cost associated to the cell
-        :param dijkstra: If true calculates the cost from the dijkstra's algorithm otherwise the normal distance
-        to target is considered.
-        :param ped: the pedestrian which has to move
-        :param cell: the cell in question
-        :return: total cost of the cell.
-        """
-        pc = self.__pedestrians_costs(ped, cell)
-        if dijkstra:
-            return cell.dijkstra_cost + pc
-        else:
-            return cell.distance_to_target + pc
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(np.array(self.cell_types.shape).tobytes())
+        for cell_type in cell_types:
+            digest.update(np.packbits(self.cell_types == cell_type).tobytes())
+        return digest.digest()
 
+    #######################################################################################################
+    # Simulation functions
+    #######################################################################################################
     def __choose_best_neighbor(self, dijkstra: bool, ped: Pedestrian):
         """
         Based on the minimum cost selects the best candidate cell for the next move.
+        The candidates are the cell of the pedestrian and its neighbours. A neighbouring target is always chosen,
+        otherwise the cheapest candidate wins and ties go to the earlier candidate, i.e. the pedestrian stays
+        rather than moving and prefers straight over diagonal steps.
+        The cost of a candidate is its cost to reach a target plus the cost of REPULSION_STENCIL of every other
+        pedestrian around it. Only the pedestrians found in the spatial hash around the candidate are summed, in
+        the order of the pedestrians list, so the sum is the same as adding the costs of all pedestrians one after
+        the other.
+        The choice runs in the compiled grid_kernels.best_neighbour_kernel.
         :param dijkstra: If true calculates the cost from the dijkstra's algorithm otherwise the normal distance
         to target is considered.
         :param ped: the pedestrian which has to move
         :return: the cell which is the best choice for the next move.
         """
-        selected_cell = ped.cell
-        min_distance = self.__get_cell_cost(dijkstra, ped, selected_cell)
-        for nc in ped.cell.straight_neighbours:
-            # if nc.cell_type.value == 1 or nc.cell_type.value == 2:
-            #     continue
-            if nc.cell_type.value == 3:
-                return nc
-            else:
-                cell_cost = self.__get_cell_cost(dijkstra, ped, nc)
-                if cell_cost < min_distance:
-                    selected_cell = nc
-                    min_distance = cell_cost
-        for nc in ped.cell.diagonal_neighbours:
-            # if nc.cell_type.value == 1 or nc.cell_type.value == 2:
-            #     continue
-            if nc.cell_type.value == 3:
-                return nc
-            else:
-                cell_cost = self.__get_cell_cost(dijkstra, ped, nc)
-                if cell_cost < min_distance:
-                    selected_cell = nc
-                    min_distance = cell_cost
-        return selected_cell
+        field = self.dijkstra_cost if dijkstra else self.distance_to_target
+        best_row, best_col = best_neighbour_kernel(self.cell_types, field, self.next_to_target,
+                                                   self.first_pedestrian, self.next_pedestrian, ped.index,
+                                                   ped.cell.row, ped.cell.col, REPULSION_STENCIL, TARGET, OBSTACLE)
+        return self.cells[best_row, best_col]
 
     def update_grid(self, current_time: int = 0, max_steps: int = 100,
                     dijkstra: bool = False, absorbing_targets: bool = True, 
@@ -548,22 +760,25 @@ class Grid:
         """
         # save the current state of the grid
         if constant_speed:
-            self.past_states.append(self.to_array())
+            self.__record_state()
             self.time_step += 1
         # pedestrians who reached the target
         to_remove_peds = []
+        # measuring points the pedestrians passed during this step, they are logged at the end of the step
+        measurements = []
+        # Targets do not appear during a step, so the cells next to a target are marked once per step
+        self.next_to_target = self.get_target_neighbourhood()
         for ped in self.pedestrians:
             # teleport pedestrian to start if the periodic boundary condition is set to true.
             if periodic_boundary:
-                if ped.cell.check_if_neighbour_is_target():
+                if self.next_to_target[ped.cell.row, ped.cell.col]:
                     next_row = ped.cell.row
                     next_col = 0
                     # Teleport the pedestrian to the start if the periodic BC are activated.
                     # This only works for RiMEA 4 currently
-                    if self.cells[next_row, next_col].cell_type.value == CellType.EMPTY.value:
-                        ped.update_cell(self.cells[next_row, next_col])
-                        self.document_measures(self.cells[next_row, next_col],
-                                               current_time, ped)
+                    if self.cell_types[next_row, next_col] == EMPTY:
+                        self.__move_pedestrian(ped, self.cells[next_row, next_col])
+                        measurements.append((self.cells[next_row, next_col], ped))
                         continue
                     # If the first cell is not free then make the pedestrian wait.
                     else:
@@ -576,31 +791,42 @@ class Grid:
                                                    max_steps=max_steps, cell_scale=self.cell_scale)
 
             # check if a complete diagonal step is possible.
-            if np.abs(ped_row) >= 1.0 and np.abs(ped_col) >= 1.0:
+            if abs(ped_row) >= 1.0 and abs(ped_col) >= 1.0:
                 # Check if the pedestrian should move a diagonally
-                ped.update_cell(selected_cell)
-                if selected_cell in self.measuring_points:
-                    self.document_measures(selected_cell, current_time, ped)
+                self.__move_pedestrian(ped, selected_cell)
+                if (selected_cell.row, selected_cell.col) in self.measuring_coords:
+                    measurements.append((selected_cell, ped))
             if not diag_bool:
                 # Check if the pedestrian should move horizontally/vertically
-                if np.abs(ped_row) >= 1.0 or np.abs(ped_col) >= 1.0:
-                    ped.update_cell(selected_cell)
-                    if selected_cell in self.measuring_points:
-                        self.document_measures(selected_cell, current_time, ped)
+                if abs(ped_row) >= 1.0 or abs(ped_col) >= 1.0:
+                    self.__move_pedestrian(ped, selected_cell)
+                    if (selected_cell.row, selected_cell.col) in self.measuring_coords:
+                        measurements.append((selected_cell, ped))
 
             # If a target is reached remove the pedestrian provided the targets are absorbing,
             # otherwise update the new cell
             if absorbing_targets:
-                if ped.cell.cell_type.value != CellType.TARGET.value:
-                    ped.cell.cell_type = CellType.PEDESTRIAN
+                if self.cell_types[ped.cell.row, ped.cell.col] != TARGET:
+                    self.cell_types[ped.cell.row, ped.cell.col] = PEDESTRIAN
                 else:
                     to_remove_peds.append(ped)
             else:
-                if ped.cell.cell_type.value != CellType.TARGET.value:
-                    ped.cell.cell_type = CellType.PEDESTRIAN
+                if self.cell_types[ped.cell.row, ped.cell.col] != TARGET:
+                    self.cell_types[ped.cell.row, ped.cell.col] = PEDESTRIAN
+
+        # Log the measurements of this step. The density does not depend on the pedestrian, so it is measured once
+        # per measuring point after all pedestrians moved.
+        densities = {}
+        for measuring_point, ped in measurements:
+            if measuring_point not in densities:
+                densities[measuring_point] = self.measure_density(measuring_point)
+            self.document_measures(measuring_point, current_time, ped, density=densities[measuring_point])
 
         # Remove pedestrians who reached the target
-        self.pedestrians = [ped for ped in self.pedestrians if ped not in to_remove_peds]
+        if to_remove_peds:
+            removed_ids = {ped.id for ped in to_remove_peds}
+            self.pedestrians = [ped for ped in self.pedestrians if ped.id not in removed_ids]
+            self.index_pedestrians()
 
     def simulate(self, no_of_steps, dijkstra=False, absorbing_targets=True, step_time: int = 300,
                  obstacle_avoidance: bool = True):
@@ -614,9 +840,10 @@ class Grid:
         :param absorbing_targets: boolean flag that decides if the pedestrians disappear when they reach a target.
         :param no_of_steps: How many steps to simulate
         :param dijkstra: whether the cost should be based on the dijkstra's algorithm
-        :return: List of past states of the scenario
+        :return: numpy array with the past states of the scenario
         """
-        self.past_states = []
+        # One state is recorded per step, allocate them up front
+        self.__reset_states(max(no_of_steps + 1 - self.time_step, 0))
         self.cells = self.initial_state
         if dijkstra:
             self.flood_dijkstra()
@@ -624,6 +851,7 @@ class Grid:
             self.fill_distances(obstacle_avoidance=obstacle_avoidance)
         while self.pedestrians and self.time_step <= no_of_steps:
             self.update_grid(dijkstra=dijkstra, absorbing_targets=absorbing_targets)
+        self.close()
         print("The simulation was took", self.time_step, "steps and was executed in", self.time_step * step_time / 1000,
               "seconds.")
         return self.past_states
@@ -631,33 +859,40 @@ class Grid:
     #######################################################################################################
     # Visiulization functions
     #######################################################################################################
-    def document_measures(self, measuring_point, current_time, ped):
+    def document_measures(self, measuring_point, current_time, ped, density: float = None):
         """
         Stores various parameters for the pedestrians who step into the measurement cells in a csv file in the logs folder.
+        The file is given by Grid.measures_path.
         :param measuring_point: The current measuring point cell
         :param current_time: Time since the start of the simulation in milliseconds
         :param ped: the pedestrian passing through the measuring point
+        :param density: (Optional) The density at the measuring point if it is already known
         :return:
         """
-        density = self.measure_density(measuring_point)
+        if density is None:
+            density = self.measure_density(measuring_point)
         speed = ped.measure_speed(cell_scale=self.cell_scale)
-        if Path("./logs/measuring_points_logs.csv").exists():
-            # Append to file
-            measuring_points_logs = open("./logs/measuring_points_logs.csv", "a", newline="")
-            measuring_points_row = [ped.id, ped.age, measuring_point.row, measuring_point.col, current_time, density,
-                                    speed]
-            writer = csv.writer(measuring_points_logs)
-            writer.writerow(measuring_points_row)
-        else:
-            # If file doesnt exist then create it.
-            measuring_points_logs = open("./logs/measuring_points_logs.csv", "a", newline="")
-            headers = ["Pedestrian_id", "Pedestrian_Age", "measuring_row", "measuring_col", "time", "density", "speed"]
-            writer = csv.writer(measuring_points_logs)
-            writer.writerow(headers)
-            measuring_points_row = [ped.id, ped.age, measuring_point.row, measuring_point.col, current_time, density,
-                                    speed]
-            writer.writerow(measuring_points_row)
-        measuring_points_logs.close()
+        if self.measures_writer is None:
+            # The log file stays open until Grid.close is called, rows are appended to it.
+            # If file doesnt exist then create it with the headers.
+            write_headers = not Path(self.measures_path).exists()
+            self.measures_log = open(self.measures_path, "a", newline="", buffering=1 << 16)
+            self.measures_writer = csv.writer(self.measures_log)
+            if write_headers:
+                self.measures_writer.writerow(["Pedestrian_id", "Pedestrian_Age", "measuring_row", "measuring_col",
+                                               "time", "density", "speed"])
+        self.measures_writer.writerow([ped.id, ped.age, measuring_point.row, measuring_point.col, current_time,
+                                       density, speed])
+
+    def close(self) -> None:
+        """
+        Writes the buffered measurements to the log file and closes it. Measurements taken afterwards reopen the file.
+        :return: None
+        """
+        if self.measures_log is not None:
+            self.measures_log.close()
+            self.measures_log = None
+            self.measures_writer = None
 
     def measure_density(self, measuring_point):
         """
@@ -665,6 +900,21 @@ class Grid:
         :param measuring_point: The current measuring point cell
         :return:
         """
+        row_min, row_max, col_min, col_max, measuring_area = self.measuring_window(measuring_point)
+        # Count pedestrians in the square
+        pedestrians_count = np.count_nonzero(self.cell_types[row_min:row_max, col_min:col_max] == PEDESTRIAN)
+        return pedestrians_count / measuring_area
+
+    def measuring_window(self, measuring_point) -> tuple:
+        """
+        Finds the square around a measuring point in which the density is measured. The result is cached in
+        Grid.measuring_windows since it does not change while the grid keeps its size.
+        :param measuring_point: The measuring point cell
+        :return: row_min, row_max, col_min, col_max of the square and its area scaled by cell_scale
+        """
+        key = (measuring_point.row, measuring_point.col)
+        if key in self.measuring_windows:
+            return self.measuring_windows[key]
 
         # Find the 10x10 square around (row,col)
         # The 10 rows are [row - 4, row + 5]
@@ -673,32 +923,17 @@ class Grid:
         # and if row = 17 out of 20 rows overall in the grid
         # Then rows are [10, 19]
         # Similarly for columns
+        # The bounds are used as slice bounds, so row_max itself is not part of the square.
+        row_max = min(max(measuring_point.row, 4) + 5, self.rows - 1)
+        row_min = max(row_max - 9, 0)
+        col_max = min(max(measuring_point.col, 4) + 5, self.cols - 1)
+        col_min = max(col_max - 9, 0)
 
-        row_min = measuring_point.row - 4 if measuring_point.row >= 4 else 0
-        row_max = measuring_point.row + 5 if measuring_point.row + 5 < self.rows else self.rows - 1
-        if row_max - measuring_point.row < 5:
-            row_min = row_min - (5 - (row_max - measuring_point.row)) \
-                if row_min - (5 - (row_max - measuring_point.row)) >= 0 else 0
-        if measuring_point.row < 4:
-            # row_min == 0
-            row_max = 9 if 9 < self.rows else self.rows - 1
-
-        col_min = measuring_point.col - 4 if measuring_point.col >= 4 else 0
-        col_max = measuring_point.col + 5 if measuring_point.col + 5 < self.cols else self.cols - 1
-        if col_max - measuring_point.col < 5:
-            col_min = col_min - (5 - (col_max - measuring_point.col)) \
-                if col_min - (5 - (col_max - measuring_point.col)) >= 0 else 0
-        if measuring_point.col < 4:
-            # col_min == 0
-            col_max = 9 if 9 < self.cols else self.cols - 1
-
-        # Count pedestrians in the square
-        pedestrians_count = len([1 for r in range(row_min, row_max)
-                                 for c in range(col_min, col_max) if self.cells[r, c].cell_type.value == 1])
         # Scale the area according to cell_scale
         measuring_area = ((row_max - row_min) * (col_max - col_min)) * (self.cell_scale * self.cell_scale)
 
-        return pedestrians_count / measuring_area
+        self.measuring_windows[key] = (row_min, row_max, col_min, col_max, measuring_area)
+        return self.measuring_windows[key]
 
     def add_pedestrian(self, row: int, col: int, speed: float = 1.33,
                        age: int = 20) -> None:
@@ -710,8 +945,28 @@ class Grid:
         :param age: The age of the pedestrian
         :return: None
         """
-        self.pedestrians.append(Pedestrian(self.cells[row, col], speed=speed, age=age))
-        self.cells[row, col].cell_type = CellType.PEDESTRIAN
+        ped = Pedestrian(self.cells[row, col], speed=speed, age=age)
+        ped.index = len(self.pedestrians)
+        self.pedestrians.append(ped)
+        if ped.index == len(self.__positions):
+            self.__grow_pedestrian_buffers()
+        self.__positions[ped.index] = row, col
+        self.__link_pedestrian(ped)
+        self.cell_types[row, col] = PEDESTRIAN
+
+    def __grow_pedestrian_buffers(self) -> None:
+        """
+        Doubles the number of pedestrians the positions and next_pedestrian can hold, so adding pedestrians one
+        by one only copies them a few times.
+        :return: None
+        """
+        capacity = max(2 * len(self.__positions), 16)
+        positions = np.empty((capacity, 2), dtype=np.int32)
+        positions[:len(self.__positions)] = self.__positions
+        self.__positions = positions
+        next_pedestrian = np.empty(capacity, dtype=np.int64)
+        next_pedestrian[:len(self.next_pedestrian)] = self.next_pedestrian
+        self.next_pedestrian = next_pedestrian
 
     def add_measuring_point(self, row: int, col: int) -> None:
         """
@@ -721,6 +976,17 @@ class Grid:
         :return: None
         """
         self.measuring_points.append(self.cells[row, col])
+        self.measuring_coords.add((row, col))
+        self.measuring_window(self.cells[row, col])
+
+    def add_measuring_points(self, coords) -> None:
+        """
+        Creates several measuring points on this grid at once, see Grid.add_measuring_point.
+        :param coords: (N, 2) array or sequence with the row and column of each measuring point
+        :return: None
+        """
+        for row, col in np.asarray(coords, dtype=int).tolist():
+            self.add_measuring_point(row, col)
 
     def to_array(self) -> np.ndarray:
         """
@@ -730,23 +996,28 @@ class Grid:
             1. Pedestrian Cell
             2. Obstacle Cell
             3. Target Cell
-        All array entries will be ints or floats
+        All array entries will be uint8
 
         For more details on the class structure please see the report or the Class docstring.
 
         :return: numpy array
         """
-        array = np.asarray([[cell.cell_type.value for cell in row] for row in self.cells])
-        return array
+        return self.cell_types.copy()
+
+    def get_path(self) -> np.ndarray:
+        """
+        :return: Returns the boolean numpy array that marks the cells which were part of the trajectory of a pedestrian.
+        """
+        return self.path.copy()
 
     def animation_frame(self, i):
         """
         This method is a helper method called by the FuncAnimation function to update the animation
         :param i: frame number
-        :return: updated image
+        :return: tuple with the updated image, the only artist that is redrawn when blitting
         """
-        self.animation.set_array(self.past_states[i])
-        return self.animation
+        self.animation.set_data(self.past_states[i])
+        return (self.animation,)
 
     def animate(self):
         """
@@ -755,20 +1026,21 @@ class Grid:
         :return: anim: Animation object
         """
         assert len(self.past_states) != 0
-        cmap = self.cmap
-        bounds = [0, 1, 2, 3, 4]
-        norm = colors.BoundaryNorm(bounds, cmap.N)
         fig, ax = plt.subplots(figsize=(10, 10))
-        self.animation = ax.imshow(self.past_states[0], cmap=cmap, norm=norm)
+        # The uint8 frames hold the cell types 0 to 3, which map straight onto the 4 colors of the colormap.
+        # A linear norm over [-0.5, 3.5] does this without the per frame binning of a BoundaryNorm.
+        self.animation = ax.imshow(self.past_states[0], cmap=self.cmap, vmin=-0.5, vmax=len(CellType) - 0.5)
         ax.grid(which='major', axis='both', linestyle='-', color='k', linewidth=2)
         ax.set_xticks(np.arange(-.5, self.cols, 1))
         ax.set_yticks(np.arange(-.5, self.rows, 1))
         # draw gridlines
+        # Only the image changes between frames, with blitting the axes, ticks and gridlines are drawn once
         anim = animation.FuncAnimation(
             fig,
             self.animation_frame,
             frames=len(self.past_states),  # nSeconds * fps,
-            interval=10000 / 30  # 10000 / fps,  # in ms
+            interval=10000 / 30,  # 10000 / fps,  # in ms
+            blit=True
         )
         plt.show()
         return anim
@@ -780,48 +1052,31 @@ class Grid:
         """
         :return: Returns the numpy array that contain all the dijkstra costs for each cell.
         """
-        dijkstra_array = []
-        for row in self.cells:
-            d_row = []
-            for cell in row:
-                d_row.append(cell.dijkstra_cost)
-            dijkstra_array.append(d_row)
-        dijkstra_array = np.asarray(dijkstra_array)
-        return dijkstra_array
+        return self.dijkstra_cost.copy()
 
     def get_distance_to_target(self) -> np.ndarray:
         """
         :return: Returns the numpy array that contain all the dijkstra costs for each cell.
         """
-        dist_to_target = []
-        for row in self.cells:
-            d_row = []
-            for cell in row:
-                d_row.append(cell.distance_to_target)
-            dist_to_target.append(d_row)
-        dist_to_target = np.asarray(dist_to_target)
-        return dist_to_target
+        return self.distance_to_target.copy()
 
     def is_valid(self):
         """
         Checks if all cells in the grid are valid cells and that there are no illegal overlap
         :return: true or false with an error message
         """
-        if any(not ped.is_valid() for ped in self.pedestrians):
+        # Same check as Pedestrian.is_valid for all pedestrians at once
+        if not (self.cell_types[self.pedestrian_positions[:, 0], self.pedestrian_positions[:, 1]] == PEDESTRIAN).all():
             return False, "Some pedestrians are standing on cells with invalid types"
 
-        for i in range(len(self.pedestrians)):
-            for j in range(i + 1, len(self.pedestrians)):
-                if self.pedestrians[i].cell.row == self.pedestrians[j].cell.row and \
-                        self.pedestrians[i].cell.col == self.pedestrians[j].cell.col:
-                    return False, f"pedestrians {self.pedestrians[i].id} and {self.pedestrians[j].id} " \
-                                  f"are standing on the same cell"
+        # Flatten the positions to one index per cell, any index that occurs twice is an overlap.
+        flat_positions = self.pedestrian_positions[:, 0].astype(np.int64) * self.cols + self.pedestrian_positions[:, 1]
+        cells, counts = np.unique(flat_positions, return_counts=True)
+        if (counts > 1).any():
+            first, second = np.flatnonzero(flat_positions == cells[counts > 1][0])[:2]
+            return False, f"pedestrians {self.pedestrians[first].id} and {self.pedestrians[second].id} " \
+                          f"are standing on the same cell"
         return True, "The grid is valid"
 
     def __str__(self):
-        res = ""
-        for row in self.cells:
-            for cell in row:
-                res += f"{cell.cell_type.value} "
-            res += "\n"
-        return res
+        return "".join(" ".join(map(str, row)) + " \n" for row in self.cell_types.tolist())
@@ -1,9 +1,6 @@
 import os
-from os import listdir
-from os.path import isfile, join
-from shutil import copyfile
+from functools import lru_cache
 
-from game_gui import start_game_gui
 from grid_structure import *
 
 
@@ -25,15 +22,38 @@ def parser_array2obj(array, obstacle_avoidance: bool = True) -> Grid:
     :return: Grid object
     """
     assert len(array.shape) == 2, f"The array to grid parser expects 2D array, given {array.shape}"
-    cells = np.array([[Cell(row, column, CellType(array[row, column]), obstacle_avoidance=obstacle_avoidance)
-                       for column in range(array.shape[1])]
-                      for row in range(array.shape[0])])
-    grid = Grid(array.shape[0], array.shape[1], cells)
+    assert np.isin(array, [cell_type.value for cell_type in CellType]).all(), \
+        "The array to grid parser expects all entries to be valid cell types"
+    grid = Grid(array.shape[0], array.shape[1], array, obstacle_avoidance=obstacle_avoidance)
     grid_valid, error_msg = grid.is_valid()
     assert grid_valid, error_msg
     return grid
 
 
+def load_scenario(filename: str) -> np.ndarray:
+    """
+    Reads a scenario file that holds the cell types in csv format, see parser_array2obj for the encoding.
+    A file is only parsed again if it was modified since it was last read.
+    :param filename: path of the scenario file
+    :return: scenario in numpy array format, the caller may modify it
+    """
+    return read_scenario_file(os.path.abspath(filename), os.stat(filename).st_mtime_ns).copy()
+
+
+@lru_cache(maxsize=16)
+def read_scenario_file(path: str, modified_time: int) -> np.ndarray:
+    """
+    Parses a scenario file straight into an int array without intermediate python lists of strings.
+    The results are cached, use load_scenario to get a copy that can be modified.
+    :param path: absolute path of the scenario file
+    :param modified_time: modification time of the file, part of the cache key so that changed files are read again
+    :return: read-only scenario in numpy array format
+    """
+    scenario = np.loadtxt(path, delimiter=',', dtype=np.int8, ndmin=2)
+    scenario.flags.writeable = False
+    return scenario
+
+
 def scenario_loader():
     """
     This is a helper function that asks if the user wishes to load an existing scenario or design their own scenario.
@@ -45,15 +65,16 @@ def scenario_loader():
     :return: Grid object, cell size meters in float
     """
     # Get the names of the available scenario files and list them nicely
-    scenario_files = [f for f in listdir('scenarios') if isfile(join('scenarios', f))]
+    # The directory entries already know their type, so no extra stat call per file is needed
+    with os.scandir('scenarios') as entries:
+        scenario_files = [entry.name for entry in entries if entry.is_file()]
     print("Available scenario files are: ")
     for i, scenario_file in enumerate(scenario_files):
         print("Scenario", i, ": ", scenario_file)
     scenario_number = int(input("Please select which scenario you wish to load. Enter scenario id: (no default value)"))
     filename = "./scenarios/" + scenario_files[scenario_number]
     # Open and read the scenario file
-    with open(filename, newline='') as csvfile:
-        scenario = np.array(list(csv.reader(csvfile))).astype(int)
+    scenario = load_scenario(filename)
     # Display the inital state of the scenario
     print("Initial state of the loaded scenario:")
     # For some presaved scenarios the cell size is not simply 1m but different. This has been hardcoded for
@@ -98,9 +119,10 @@ def scenario_builder():
             grid_size_input_accepted = True
             grid_size = [30, 30]
         else:
-            grid_size = grid_size.split(',')
+            grid_size = [dim.strip() for dim in grid_size.split(',')]
             if len(grid_size) == 2 and all(dim.isdigit() and int(dim) > 0 for dim in grid_size):
                 grid_size_input_accepted = True
+                grid_size = [int(dim) for dim in grid_size]
                 cell_scale_meters = float(cell_scale_meters)
             else:
                 print(f"Unacceptable Input")
@@ -109,115 +131,31 @@ def scenario_builder():
 
 
 def execute_rimea_4():
-    with open('./scenarios/rimea_test4.csv', newline='') as csvfile:
-        rimea_4_1 = np.array(list(csv.reader(csvfile))).astype(int)
-        rimea_4_1 = parser_array2obj(rimea_4_1)
-    with open('./scenarios/rimea_test4.csv', newline='') as csvfile:
-        rimea_4_2 = np.array(list(csv.reader(csvfile))).astype(int)
-        rimea_4_2 = parser_array2obj(rimea_4_2)
-    with open('./scenarios/rimea_test4.csv', newline='') as csvfile:
-        rimea_4_3 = np.array(list(csv.reader(csvfile))).astype(int)
-        rimea_4_3 = parser_array2obj(rimea_4_3)
-    with open('./scenarios/rimea_test4.csv', newline='') as csvfile:
-        rimea_4_4 = np.array(list(csv.reader(csvfile))).astype(int)
-        rimea_4_4 = parser_array2obj(rimea_4_4)
-    with open('./scenarios/rimea_test4.csv', newline='') as csvfile:
-        rimea_4_5 = np.array(list(csv.reader(csvfile))).astype(int)
-        rimea_4_5 = parser_array2obj(rimea_4_5)
-    with open('./scenarios/rimea_test4.csv', newline='') as csvfile:
-        rimea_4_6 = np.array(list(csv.reader(csvfile))).astype(int)
-        rimea_4_6 = parser_array2obj(rimea_4_6)
+    # pygame is only needed to show the runs, so it is not loaded when utilities is imported for the parser
+    from game_gui import start_game_gui
+
+    # All six runs start from the same scenario, so it is read once and parsed into six independent grids
+    rimea_4 = load_scenario('./scenarios/rimea_test4.csv')
+    rimea_4_grids = [parser_array2obj(rimea_4) for _ in range(6)]
 
     cell_scale_meters = 0.3333
-    rimea_4_1.set_cell_scale(cell_scale_meters)
-    rimea_4_1.flood_pedestrians(1)
-    rimea_4_2.set_cell_scale(cell_scale_meters)
-    rimea_4_2.flood_pedestrians(2)
-    rimea_4_3.set_cell_scale(cell_scale_meters)
-    rimea_4_3.flood_pedestrians(3)
-    rimea_4_4.set_cell_scale(cell_scale_meters)
-    rimea_4_4.flood_pedestrians(4)
-    rimea_4_5.set_cell_scale(cell_scale_meters)
-    rimea_4_5.flood_pedestrians(5)
-    rimea_4_6.set_cell_scale(cell_scale_meters)
-    rimea_4_6.flood_pedestrians(6)
-
-    # Actual Measuring Point
-    rimea_4_1.add_measuring_point(15, 5)
-    rimea_4_1.add_measuring_point(15, 6)
-    rimea_4_1.add_measuring_point(16, 5)
-    rimea_4_1.add_measuring_point(16, 6)
-    rimea_4_2.add_measuring_point(15, 5)
-    rimea_4_2.add_measuring_point(15, 6)
-    rimea_4_2.add_measuring_point(16, 5)
-    rimea_4_2.add_measuring_point(16, 6)
-    rimea_4_3.add_measuring_point(15, 5)
-    rimea_4_3.add_measuring_point(15, 6)
-    rimea_4_3.add_measuring_point(16, 5)
-    rimea_4_3.add_measuring_point(16, 6)
-    rimea_4_4.add_measuring_point(15, 5)
-    rimea_4_4.add_measuring_point(15, 6)
-    rimea_4_4.add_measuring_point(16, 5)
-    rimea_4_4.add_measuring_point(16, 6)
-    rimea_4_5.add_measuring_point(15, 5)
-    rimea_4_5.add_measuring_point(15, 6)
-    rimea_4_5.add_measuring_point(16, 5)
-    rimea_4_5.add_measuring_point(16, 6)
-    rimea_4_6.add_measuring_point(15, 5)
-    rimea_4_6.add_measuring_point(15, 6)
-    rimea_4_6.add_measuring_point(16, 5)
-    rimea_4_6.add_measuring_point(16, 6)
-
-    # Control Point
-    rimea_4_1.add_measuring_point(15, 25)
-    rimea_4_1.add_measuring_point(15, 26)
-    rimea_4_1.add_measuring_point(16, 25)
-    rimea_4_1.add_measuring_point(16, 26)
-    rimea_4_2.add_measuring_point(15, 25)
-    rimea_4_2.add_measuring_point(15, 26)
-    rimea_4_2.add_measuring_point(16, 25)
-    rimea_4_2.add_measuring_point(16, 26)
-    rimea_4_3.add_measuring_point(15, 25)
-    rimea_4_3.add_measuring_point(15, 26)
-    rimea_4_3.add_measuring_point(16, 25)
-    rimea_4_3.add_measuring_point(16, 26)
-    rimea_4_4.add_measuring_point(15, 25)
-    rimea_4_4.add_measuring_point(15, 26)
-    rimea_4_4.add_measuring_point(16, 25)
-    rimea_4_4.add_measuring_point(16, 26)
-    rimea_4_5.add_measuring_point(15, 25)
-    rimea_4_5.add_measuring_point(15, 26)
-    rimea_4_5.add_measuring_point(16, 25)
-    rimea_4_5.add_measuring_point(16, 26)
-    rimea_4_6.add_measuring_point(15, 25)
-    rimea_4_6.add_measuring_point(15, 26)
-    rimea_4_6.add_measuring_point(16, 25)
-    rimea_4_6.add_measuring_point(16, 26)
-
-    # We delete the log file incase it already exists.
-    if Path("./logs/measuring_points_logs.csv").exists():
-        os.remove("logs/measuring_points_logs.csv")
-
-    start_game_gui(rimea_4_1, max_steps=30, dijkstra=False, step_time=750 * cell_scale_meters,
-                   periodic_boundary=True)
-    copyfile("./logs/measuring_points_logs.csv", "./logs/measuring_points_logs_rimea_4_density1.csv")
-
-    start_game_gui(rimea_4_2, max_steps=30, dijkstra=False, step_time=750 * cell_scale_meters,
-                   periodic_boundary=True)
-    copyfile("./logs/measuring_points_logs.csv", "./logs/measuring_points_logs_rimea_4_density2.csv")
-
-    start_game_gui(rimea_4_3, max_steps=30, dijkstra=False, step_time=750 * cell_scale_meters,
-                   periodic_boundary=True)
-    copyfile("./logs/measuring_points_logs.csv", "./logs/measuring_points_logs_rimea_4_density3.csv")
-
-    start_game_gui(rimea_4_4, max_steps=30, dijkstra=False, step_time=750 * cell_scale_meters,
-                   periodic_boundary=True)
-    copyfile("./logs/measuring_points_logs.csv", "./logs/measuring_points_logs_rimea_4_density4.csv")
-
-    start_game_gui(rimea_4_5, max_steps=30, dijkstra=False, step_time=750 * cell_scale_meters,
-                   periodic_boundary=True)
-    copyfile("./logs/measuring_points_logs.csv", "./logs/measuring_points_logs_rimea_4_density5.csv")
-
-    start_game_gui(rimea_4_6, max_steps=30, dijkstra=False, step_time=750 * cell_scale_meters,
-                   periodic_boundary=True)
-    copyfile("./logs/measuring_points_logs.csv", "./logs/measuring_points_logs_rimea_4_density6.csv")
+    measuring_points = np.array([
+        # Actual Measuring Point
+        (15, 5), (15, 6), (16, 5), (16, 6),
+        # Control Point
+        (15, 25), (15, 26), (16, 25), (16, 26)
+    ])
+    # The runs only differ in the density of the pedestrians, which is 1 to 6 pedestrians per square meter
+    for density, grid in enumerate(rimea_4_grids, start=1):
+        grid.set_cell_scale(cell_scale_meters)
+        grid.flood_pedestrians(density)
+        grid.add_measuring_points(measuring_points)
+        # Every run logs into its own file, which is deleted in case it already exists.
+        grid.measures_path = f"./logs/measuring_points_logs_rimea_4_density{density}.csv"
+        if Path(grid.measures_path).exists():
+            os.remove(grid.measures_path)
+
+    # The runs are shown one after the other, each one waits in its own window for the start button.
+    for grid in rimea_4_grids:
+        start_game_gui(grid, max_steps=30, dijkstra=False, step_time=750 * cell_scale_meters,
+                       periodic_boundary=True)
@@ -3,6 +3,19 @@ import matplotlib.pyplot as plt
 import numpy as np
 from matplotlib import colors
 
+# The colors and legend do not depend on the scenario, so they are created once for all calls.
+# Create color map to separately label each element on grid
+CMAP = colors.ListedColormap(['blue', 'red', 'yellow', 'green'])
+# Add labels for a good legend
+LABELS = ['Empty Cell', 'Pedestrian', 'Obstical', 'Target']
+LEGEND_PATCHES = [mpatches.Patch(color=CMAP.colors[i], label=LABELS[i]) for i in range(4)]
+# RGBA color of each cell type, indexing it with a scenario gives the image without a colormap and norm
+COLOR_TABLE = (colors.to_rgba_array(CMAP.colors) * 255).round().astype(np.uint8)
+# Grids with more cells than this along one side get their cell borders drawn without a tick per cell
+MAX_TICKED_CELLS = 50
+# Backends that never show a figure. With these the figure is only saved, so it is closed right away.
+NON_INTERACTIVE_BACKENDS = ('agg', 'cairo', 'pdf', 'pgf', 'ps', 'svg', 'template')
+
 
 def visualize_state(scenario):
     """
@@ -21,19 +34,23 @@ def visualize_state(scenario):
 
     # extract size of plot
     rows, cols = scenario.shape
-    # Create color map to separately label each element on grid
-    cmap = colors.ListedColormap(['blue', 'red', 'yellow', 'green'])
-    bounds = [0, 1, 2, 3, 4]
-    norm = colors.BoundaryNorm(bounds, cmap.N)
     fig, ax = plt.subplots(figsize=(10, 10))
-    img = ax.imshow(scenario, cmap=cmap, norm=norm)
-    # Make grid with x,y ticks for proper partitioning in visualization
-    ax.grid(which='major', axis='both', linestyle='-', color='k', linewidth=2)
-    ax.set_xticks(np.arange(0.5, cols, 1))
-    ax.set_yticks(np.arange(0.5, rows, 1))
-    # Add labels for a good legend
-    labels = ['Empty Cell', 'Pedestrian', 'Obstical', 'Target']
-    patches = [mpatches.Patch(color=cmap.colors[i], label=labels[i]) for i in range(4)]
-    plt.legend(handles=patches, bbox_to_anchor=(1.1, 1.), prop={"size": 6})
-    plt.tight_layout()
+    img = ax.imshow(COLOR_TABLE[np.asarray(scenario).astype(np.uint8)], interpolation='none')
+    if max(rows, cols) <= MAX_TICKED_CELLS:
+        # Make grid with x,y ticks for proper partitioning in visualization
+        ax.grid(which='major', axis='both', linestyle='-', color='k', linewidth=2)
+        ax.set_xticks(np.arange(cols) + 0.5)
+        ax.set_yticks(np.arange(rows) + 0.5)
+    else:
+        # One tick per cell is unreadable and slow to draw for large grids, the same lines are drawn as
+        # two line collections and the axes keep their default ticks.
+        ax.hlines(np.arange(rows) + 0.5, -0.5, cols - 0.5, colors='k', linewidth=2)
+        ax.vlines(np.arange(cols) + 0.5, -0.5, rows - 0.5, colors='k', linewidth=2)
+    plt.legend(handles=LEGEND_PATCHES, bbox_to_anchor=(1.1, 1.), prop={"size": 6})
+    # Fixed margins that leave room for the tick labels and the legend. They match what tight_layout computes
+    # for the scenarios in the scenarios folder without measuring all the tick labels on every call.
+    fig.subplots_adjust(left=0.055, right=0.915, bottom=0.04, top=0.985)
     fig.savefig('./figures/visuals.pdf')
+    # Inline and gui backends still have to show the figure, they release it once it was shown
+    if plt.get_backend().lower() in NON_INTERACTIVE_BACKENDS:
+        plt.close(fig)